@@ -5,7 +5,9 @@ from unittest.mock import patch
 
 import pytest
 import pytz
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
 from django.core import mail
+from django.test import override_settings
 from rest_framework import status
 
 from posthog.models import Dashboard, Organization, OrganizationMembership, Team, User
@@ -13,6 +15,23 @@ from posthog.models.organization import OrganizationInvite
 from posthog.test.base import APIBaseTest
 from posthog.utils import get_instance_realm
 
+try:
+    from ee.models.license import License
+except ImportError:
+    License = None  # type: ignore
+
+
+def _assert_nothing_created_by_signup(test_case: APIBaseTest) -> None:
+    """
+    Asserts that a failed signup didn't create anything, i.e. only the class-level test data exists
+    (the user being there only if one is set up through `CONFIG_EMAIL`).
+    """
+    test_case.assertEqual(
+        list(User.objects.values_list("id", flat=True)), [test_case.user.id] if test_case.user else [],
+    )
+    test_case.assertEqual(list(Team.objects.values_list("id", flat=True)), [test_case.team.id])
+    test_case.assertEqual(list(Organization.objects.values_list("id", flat=True)), [test_case.organization.id])
+
 
 class TestOrganizationAPI(APIBaseTest):
 
@@ -153,22 +172,26 @@ class TestSignup(APIBaseTest):
     CONFIG_EMAIL = None
 
     @pytest.mark.skip_on_multitenancy
-    @patch("posthog.api.organization.settings.EE_AVAILABLE", False)
+    @override_settings(EE_AVAILABLE=False)
     @patch("posthog.api.organization.posthoganalytics.capture")
     def test_api_sign_up(self, mock_capture):
-        response = self.client.post(
-            "/api/signup/",
-            {
-                "first_name": "John",
-                "email": "hedgehog@posthog.com",
-                "password": "notsecure",
-                "organization_name": "Hedgehogs United, LLC",
-                "email_opt_in": False,
-            },
-        )
+        # Covers the whole request: user, organization, team & membership creation (incl. the default dashboard and its
+        # 7 items), the login session writes and the savepoints. When the `ee` package is installed the license is
+        # looked up too. Both counts were measured, pinned to catch N+1 regressions in the signup serializer.
+        with self.assertNumQueries(34 if License is None else 35):
+            response = self.client.post(
+                "/api/signup/",
+                {
+                    "first_name": "John",
+                    "email": "hedgehog@posthog.com",
+                    "password": "notsecure",
+                    "organization_name": "Hedgehogs United, LLC",
+                    "email_opt_in": False,
+                },
+            )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-        user = cast(User, User.objects.order_by("-pk")[0])
+        user = User.objects.get(pk=response.json()["id"])
         team = cast(Team, user.team)
         organization = cast(Organization, user.organization)
 
@@ -247,7 +270,7 @@ class TestSignup(APIBaseTest):
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-        user = cast(User, User.objects.order_by("-pk").get())
+        user = User.objects.get(pk=response.json()["id"])
         organization = cast(Organization, user.organization)
         self.assertEqual(
             response.json(),
@@ -283,18 +306,12 @@ class TestSignup(APIBaseTest):
         )
 
         # Assert that the user is logged in
-        response = self.client.get("/api/user/")
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.json()["email"], "hedgehog2@posthog.com")
+        self.assertEqual(self.client.session[SESSION_KEY], str(user.pk))
 
         # Assert that the password was correctly saved
         self.assertTrue(user.check_password("notsecure"))
 
     def test_cant_sign_up_without_required_attributes(self):
-        count: int = User.objects.count()
-        team_count: int = Team.objects.count()
-        org_count: int = Organization.objects.count()
-
         required_attributes = [
             "first_name",
             "email",
@@ -311,7 +328,7 @@ class TestSignup(APIBaseTest):
 
             # Make sure the endpoint works with and without the trailing slash
             response = self.client.post("/api/signup", body)
-            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=f"missing {attribute}")
             self.assertEqual(
                 response.json(),
                 {
@@ -320,16 +337,12 @@ class TestSignup(APIBaseTest):
                     "detail": "This field is required.",
                     "attr": attribute,
                 },
+                msg=f"missing {attribute}",
             )
 
-        self.assertEqual(User.objects.count(), count)
-        self.assertEqual(Team.objects.count(), team_count)
-        self.assertEqual(Organization.objects.count(), org_count)
+        _assert_nothing_created_by_signup(self)
 
     def test_cant_sign_up_with_short_password(self):
-        count: int = User.objects.count()
-        team_count: int = Team.objects.count()
-
         response = self.client.post(
             "/api/signup/", {"first_name": "Jane", "email": "failed@posthog.com", "password": "123"},
         )
@@ -344,8 +357,7 @@ class TestSignup(APIBaseTest):
             },
         )
 
-        self.assertEqual(User.objects.count(), count)
-        self.assertEqual(Team.objects.count(), team_count)
+        _assert_nothing_created_by_signup(self)
 
     @patch("posthoganalytics.feature_enabled")
     def test_default_dashboard_is_created_on_signup(self, mock_feature_enabled):
@@ -365,7 +377,7 @@ class TestSignup(APIBaseTest):
         )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
-        user: User = User.objects.order_by("-pk").get()
+        user: User = User.objects.get(pk=response.json()["id"])
 
         mock_feature_enabled.assert_any_call("new-onboarding-2822", user.distinct_id)
 
@@ -381,16 +393,16 @@ class TestSignup(APIBaseTest):
             },
         )
 
-        dashboard: Dashboard = Dashboard.objects.first()  # type: ignore
-        self.assertEqual(dashboard.team, user.team)
-        self.assertEqual(dashboard.items.count(), 1)
-        self.assertEqual(dashboard.name, "Web Analytics")
-        self.assertEqual(
-            dashboard.items.all()[0].description, "Shows a conversion funnel from sign up to watching a movie."
-        )
+        dashboards = list(Dashboard.objects.filter(team=user.team).order_by("id").prefetch_related("items"))
 
         # Particularly assert that the default dashboards are not created (because we create special demo dashboards)
-        self.assertEqual(Dashboard.objects.filter(team=user.team).count(), 3)  # Web, app & revenue demo dashboards
+        self.assertEqual(len(dashboards), 3)  # Web, app & revenue demo dashboards
+
+        dashboard = dashboards[0]
+        items = dashboard.items.all()
+        self.assertEqual(dashboard.name, "Web Analytics")
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].description, "Shows a conversion funnel from sign up to watching a movie.")
 
 
 class TestInviteSignup(APIBaseTest):
@@ -403,9 +415,7 @@ class TestInviteSignup(APIBaseTest):
     # Invite pre-validation
 
     def test_api_invite_sign_up_prevalidate(self):
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+19@posthog.com", organization=self.organization,
-        )
+        invite = self._create_invite("test+19@posthog.com")
 
         response = self.client.get(f"/api/signup/{invite.id}/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -420,9 +430,7 @@ class TestInviteSignup(APIBaseTest):
         )
 
     def test_api_invite_sign_up_with_first_nameprevalidate(self):
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+58@posthog.com", organization=self.organization, first_name="Jane"
-        )
+        invite = self._create_invite("test+58@posthog.com", first_name="Jane")
 
         response = self.client.get(f"/api/signup/{invite.id}/")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -439,9 +447,7 @@ class TestInviteSignup(APIBaseTest):
     def test_api_invite_sign_up_prevalidate_for_existing_user(self):
         user = self._create_user("test+29@posthog.com", "test_password")
         new_org = Organization.objects.create(name="Test, Inc")
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+29@posthog.com", organization=new_org,
-        )
+        invite = self._create_invite("test+29@posthog.com", organization=new_org)
 
         self.client.force_login(user)
         response = self.client.get(f"/api/signup/{invite.id}/")
@@ -460,7 +466,7 @@ class TestInviteSignup(APIBaseTest):
 
         for invalid_invite in [uuid.uuid4(), "abc", "1234"]:
             response = self.client.get(f"/api/signup/{invalid_invite}/")
-            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=f"invite ID {invalid_invite}")
             self.assertEqual(
                 response.json(),
                 {
@@ -469,13 +475,12 @@ class TestInviteSignup(APIBaseTest):
                     "detail": "The provided invite ID is not valid.",
                     "attr": None,
                 },
+                msg=f"invite ID {invalid_invite}",
             )
 
     def test_existing_user_cant_claim_invite_if_it_doesnt_match_target_email(self):
         user = self._create_user("test+39@posthog.com", "test_password")
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+49@posthog.com", organization=self.organization,
-        )
+        invite = self._create_invite("test+49@posthog.com")
 
         self.client.force_login(user)
         response = self.client.get(f"/api/signup/{invite.id}/")
@@ -492,9 +497,7 @@ class TestInviteSignup(APIBaseTest):
         )
 
     def test_api_invite_sign_up_prevalidate_expired_invite(self):
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+59@posthog.com", organization=self.organization,
-        )
+        invite = self._create_invite("test+59@posthog.com")
         invite.created_at = datetime.datetime(2020, 12, 1, tzinfo=pytz.UTC)
         invite.save()
 
@@ -513,17 +516,20 @@ class TestInviteSignup(APIBaseTest):
     # Signup (using invite)
 
     @patch("posthoganalytics.capture")
-    @patch("posthog.api.organization.settings.EE_AVAILABLE", True)
+    @override_settings(EE_AVAILABLE=True)
     def test_api_invite_sign_up(self, mock_capture):
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+99@posthog.com", organization=self.organization,
-        )
+        invite = self._create_invite("test+99@posthog.com")
 
-        response = self.client.post(
-            f"/api/signup/{invite.id}/", {"first_name": "Alice", "password": "test_password", "email_opt_in": True},
-        )
+        # Covers the whole request: invite lookup & deletion, user & membership creation, the login session writes, the
+        # savepoints and the eagerly run identify task. When the `ee` package is installed the license is looked up too
+        # and the invites are fetched before being deleted (no fast delete). Both counts were measured, pinned to catch
+        # N+1 regressions in the invite signup serializer.
+        with self.assertNumQueries(32 if License is None else 34):
+            response = self.client.post(
+                f"/api/signup/{invite.id}/", {"first_name": "Alice", "password": "test_password", "email_opt_in": True},
+            )
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-        user = cast(User, User.objects.order_by("-pk")[0])
+        user = User.objects.get(pk=response.json()["id"])
         self.assertEqual(
             response.json(),
             {
@@ -563,56 +569,19 @@ class TestInviteSignup(APIBaseTest):
         )
 
         # Assert that the user is logged in
-        response = self.client.get("/api/user/")
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.json()["email"], "test+99@posthog.com")
+        self.assertEqual(self.client.session[SESSION_KEY], str(user.pk))
 
         # Assert that the password was correctly saved
         self.assertTrue(user.check_password("test_password"))
 
-    @patch("posthog.api.organization.settings.EE_AVAILABLE", False)
-    def test_api_invite_sign_up_member_joined_email_is_not_sent_for_initial_member(self):
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+100@posthog.com", organization=self.organization,
-        )
-
-        with self.settings(EMAIL_ENABLED=True, EMAIL_HOST="localhost", SITE_URL="http://test.posthog.com"):
-            response = self.client.post(
-                f"/api/signup/{invite.id}/", {"first_name": "Alice", "password": "test_password", "email_opt_in": True},
-            )
-
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-
-        self.assertEqual(len(mail.outbox), 0)
-
-    @patch("posthog.api.organization.settings.EE_AVAILABLE", False)
-    def test_api_invite_sign_up_member_joined_email_is_sent_for_next_members(self):
-        initial_user = User.objects.create_and_join(self.organization, "test+420@posthog.com", None)
-
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+100@posthog.com", organization=self.organization,
-        )
-
-        with self.settings(EMAIL_ENABLED=True, EMAIL_HOST="localhost", SITE_URL="http://test.posthog.com"):
-            response = self.client.post(
-                f"/api/signup/{invite.id}/", {"first_name": "Alice", "password": "test_password", "email_opt_in": True},
-            )
-
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
-
-        self.assertEqual(len(mail.outbox), 1)
-        self.assertListEqual(mail.outbox[0].to, [initial_user.email])
-
     @patch("posthoganalytics.identify")
     @patch("posthoganalytics.capture")
-    @patch("posthog.api.organization.settings.EE_AVAILABLE", False)
+    @override_settings(EE_AVAILABLE=False)
     def test_existing_user_can_sign_up_to_a_new_organization(self, mock_capture, mock_identify):
         user = self._create_user("test+159@posthog.com", "test_password")
         new_org = Organization.objects.create(name="TestCo")
         new_team = Team.objects.create(organization=new_org)
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+159@posthog.com", organization=new_org,
-        )
+        invite = self._create_invite("test+159@posthog.com", organization=new_org)
 
         self.client.force_login(user)
 
@@ -662,9 +631,9 @@ class TestInviteSignup(APIBaseTest):
         )
         mock_identify.assert_called_once()
 
-        # Assert that the user remains logged in
-        response = self.client.get("/api/user/")
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Assert that the user remains logged in (the auth hash would stop matching if e.g. the password changed)
+        self.assertEqual(self.client.session[SESSION_KEY], str(user.pk))
+        self.assertEqual(self.client.session[HASH_SESSION_KEY], user.get_session_auth_hash())
 
     @patch("posthoganalytics.capture")
     def test_cannot_use_claim_invite_endpoint_to_update_user(self, mock_capture):
@@ -678,9 +647,7 @@ class TestInviteSignup(APIBaseTest):
         user2.join(organization=new_org)
 
         Team.objects.create(organization=new_org)
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+189@posthog.com", organization=new_org,
-        )
+        invite = self._create_invite("test+189@posthog.com", organization=new_org)
 
         self.client.force_login(user)
 
@@ -719,18 +686,12 @@ class TestInviteSignup(APIBaseTest):
         )
 
     def test_cant_claim_sign_up_invite_without_required_attributes(self):
-        count: int = User.objects.count()
-        team_count: int = Team.objects.count()
-        org_count: int = Organization.objects.count()
-
         required_attributes = [
             "first_name",
             "password",
         ]
 
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+799@posthog.com", organization=self.organization,
-        )
+        invite = self._create_invite("test+799@posthog.com")
 
         for attribute in required_attributes:
             body = {
@@ -740,7 +701,7 @@ class TestInviteSignup(APIBaseTest):
             body.pop(attribute)
 
             response = self.client.post(f"/api/signup/{invite.id}/", body)
-            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, msg=f"missing {attribute}")
             self.assertEqual(
                 response.json(),
                 {
@@ -749,20 +710,13 @@ class TestInviteSignup(APIBaseTest):
                     "detail": "This field is required.",
                     "attr": attribute,
                 },
+                msg=f"missing {attribute}",
             )
 
-        self.assertEqual(User.objects.count(), count)
-        self.assertEqual(Team.objects.count(), team_count)
-        self.assertEqual(Organization.objects.count(), org_count)
+        _assert_nothing_created_by_signup(self)
 
     def test_cant_claim_invite_sign_up_with_short_password(self):
-        count: int = User.objects.count()
-        team_count: int = Team.objects.count()
-        org_count: int = Organization.objects.count()
-
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+799@posthog.com", organization=self.organization,
-        )
+        invite = self._create_invite("test+799@posthog.com")
 
         response = self.client.post(f"/api/signup/{invite.id}/", {"first_name": "Charlie", "password": "123"})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -776,15 +730,9 @@ class TestInviteSignup(APIBaseTest):
             },
         )
 
-        self.assertEqual(User.objects.count(), count)
-        self.assertEqual(Team.objects.count(), team_count)
-        self.assertEqual(Organization.objects.count(), org_count)
+        _assert_nothing_created_by_signup(self)
 
     def test_cant_claim_invalid_invite(self):
-        count: int = User.objects.count()
-        team_count: int = Team.objects.count()
-        org_count: int = Organization.objects.count()
-
         response = self.client.post(
             f"/api/signup/{uuid.uuid4()}/", {"first_name": "Charlie", "password": "test_password"}
         )
@@ -799,18 +747,10 @@ class TestInviteSignup(APIBaseTest):
             },
         )
 
-        self.assertEqual(User.objects.count(), count)
-        self.assertEqual(Team.objects.count(), team_count)
-        self.assertEqual(Organization.objects.count(), org_count)
+        _assert_nothing_created_by_signup(self)
 
     def test_cant_claim_expired_invite(self):
-        count: int = User.objects.count()
-        team_count: int = Team.objects.count()
-        org_count: int = Organization.objects.count()
-
-        invite: OrganizationInvite = OrganizationInvite.objects.create(
-            target_email="test+799@posthog.com", organization=self.organization,
-        )
+        invite = self._create_invite("test+799@posthog.com")
         invite.created_at = datetime.datetime(2020, 3, 3, tzinfo=pytz.UTC)
         invite.save()
 
@@ -826,9 +766,7 @@ class TestInviteSignup(APIBaseTest):
             },
         )
 
-        self.assertEqual(User.objects.count(), count)
-        self.assertEqual(Team.objects.count(), team_count)
-        self.assertEqual(Organization.objects.count(), org_count)
+        _assert_nothing_created_by_signup(self)
 
     # Social signup (use invite)
 
@@ -852,29 +790,51 @@ class TestInviteSignup(APIBaseTest):
     def test_cannot_use_social_invite_sign_up_if_social_session_is_not_active(self):
 
         response = self.client.post("/api/social_signup", {"organization_name": "Tech R Us", "email_opt_in": False})
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(
-            response.json(),
-            {
-                "type": "validation_error",
-                "code": "invalid_input",
-                "detail": "Inactive social login session. Go to /login and log in before continuing.",
-                "attr": None,
-            },
+        self.assertValidationError(
+            response,
+            code="invalid_input",
+            detail="Inactive social login session. Go to /login and log in before continuing.",
         )
-        self.assertEqual(len(self.client.session.keys()), 0)  # Nothing is saved in the session
+        self.assertNoSessionWritten(response)
 
     def test_cannot_use_social_invite_sign_up_without_required_attributes(self):
 
         response = self.client.post("/api/social_signup", {"email_opt_in": False})
-        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertEqual(
-            response.json(),
-            {
-                "type": "validation_error",
-                "code": "required",
-                "detail": "This field is required.",
-                "attr": "organization_name",
-            },
+        self.assertValidationError(
+            response, code="required", detail="This field is required.", attr="organization_name"
+        )
+        self.assertNoSessionWritten(response)
+
+
+@override_settings(EE_AVAILABLE=False, EMAIL_ENABLED=True, EMAIL_HOST="localhost", SITE_URL="http://test.posthog.com")
+class TestInviteSignupEmail(APIBaseTest):
+    """
+    Tests the emails sent when users sign up with an invite (email services are available for the whole class).
+    """
+
+    CONFIG_EMAIL = None
+
+    def test_api_invite_sign_up_member_joined_email_is_not_sent_for_initial_member(self):
+        invite = self._create_invite("test+100@posthog.com")
+
+        response = self.client.post(
+            f"/api/signup/{invite.id}/", {"first_name": "Alice", "password": "test_password", "email_opt_in": True},
         )
-        self.assertEqual(len(self.client.session.keys()), 0)  # Nothing is saved in the session
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_api_invite_sign_up_member_joined_email_is_sent_for_next_members(self):
+        initial_user = User.objects.create_and_join(self.organization, "test+420@posthog.com", None)
+
+        invite = self._create_invite("test+100@posthog.com")
+
+        response = self.client.post(
+            f"/api/signup/{invite.id}/", {"first_name": "Alice", "password": "test_password", "email_opt_in": True},
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertListEqual(mail.outbox[0].to, [initial_user.email])
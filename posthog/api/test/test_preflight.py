@@ -11,6 +11,11 @@ from posthog.models.organization import OrganizationInvite
 from posthog.test.base import APIBaseTest
 from posthog.version import VERSION
 
+try:
+    from ee.models.license import License, LicenseManager
+except ImportError:
+    License = LicenseManager = None  # type: ignore
+
 
 class TestPreflight(APIBaseTest):
     def test_preflight_request_unauthenticated(self):
@@ -172,10 +177,9 @@ class TestPreflight(APIBaseTest):
             self.assertDictContainsSubset({"Europe/Moscow": 3, "UTC": 0}, available_timezones)
 
     @pytest.mark.ee
+    @pytest.mark.skipif(License is None, reason="Enterprise Edition is not available")
     def test_ee_preflight_with_users_limit(self):
 
-        from ee.models.license import License, LicenseManager
-
         super(LicenseManager, cast(LicenseManager, License.objects)).create(
             key="key_123", plan="free_clickhouse", valid_until=timezone.datetime(2038, 1, 19, 3, 14, 7), max_users=3,
         )
@@ -550,6 +550,11 @@ if TEST:
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
     }
 
+    if not E2E_TESTING:
+        # Test-only: password hashing is deliberately slow, so unit tests use a fast (insecure) hasher instead.
+        # Not applied to E2E runs, as their users are created with the default hasher outside of TEST mode.
+        PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
     import celery
 
     celery.current_app.conf.CELERY_ALWAYS_EAGER = True
@@ -1,10 +1,12 @@
 from typing import Dict, Optional
 
+from django.conf import settings
 from django.test import TestCase
+from rest_framework import status
 from rest_framework.test import APITestCase as DRFTestCase
 
 from posthog.models import Organization, Team, User
-from posthog.models.organization import OrganizationMembership
+from posthog.models.organization import OrganizationInvite, OrganizationMembership
 
 
 def _setup_test_data(klass):
@@ -97,6 +99,13 @@ class TestMixin:
     def _create_user(self, email: str, password: Optional[str] = None, first_name: str = "", **kwargs) -> User:
         return User.objects.create_and_join(self.organization, email, password, first_name, **kwargs)
 
+    def _create_invite(
+        self, target_email: str, organization: Optional[Organization] = None, **kwargs
+    ) -> OrganizationInvite:
+        return OrganizationInvite.objects.create(
+            target_email=target_email, organization=organization or self.organization, **kwargs
+        )
+
     @classmethod
     def setUpTestData(cls):
         if cls.CLASS_DATA_LEVEL_SETUP:
@@ -126,3 +135,22 @@ class APIBaseTest(TestMixin, ErrorResponsesMixin, DRFTestCase):
         super().setUp()
         if self.CONFIG_AUTO_LOGIN and self.user:
             self.client.force_login(self.user)
+
+    def assertValidationError(
+        self,
+        response,
+        *,
+        code: str,
+        detail: str,
+        attr: Optional[str] = None,
+        status_code: int = status.HTTP_400_BAD_REQUEST,
+    ) -> None:
+        self.assertEqual(response.status_code, status_code)
+        self.assertEqual(response.json(), self.validation_error_response(detail, code=code, attr=attr))
+
+    def assertNoSessionWritten(self, response) -> None:
+        """
+        Asserts that the request didn't save (or flush) anything in the session, without loading it from the session
+        backend (Django only sends the session cookie in a response when the session was modified).
+        """
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)